@@ -6,7 +6,8 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
-import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 DOCUMENTATION = r'''
 ---
@@ -124,19 +125,53 @@ instance:
 
 HAS_PYVMOMI = False
 try:
-    import pyVmomi
     from pyVmomi import vim, vmodl
 
     HAS_PYVMOMI = True
 except ImportError:
     pass
 
-from ansible.module_utils.basic import AnsibleModule
+if HAS_PYVMOMI:
+    # pyVmomi types used on the comparison paths
+    _REMOTE_BACKING = vim.vm.device.VirtualFloppy.RemoteDeviceBackingInfo
+    _IMAGE_BACKING = vim.vm.device.VirtualFloppy.ImageBackingInfo
+    _SIO_CTRL = vim.vm.device.VirtualSIOController
+    _FLOPPY = vim.vm.device.VirtualFloppy
+    _POWER_ON = vim.VirtualMachinePowerState.poweredOn
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
 from ansible.module_utils._text import to_text, to_native
-from ansible.module_utils.vmware import (find_obj, gather_vm_facts, get_all_objs,
+from ansible.module_utils.vmware import (find_obj, find_datacenter_by_name, gather_vm_facts, get_all_objs,
                                          compile_folder_path_for_object, serialize_spec,
                                          vmware_argument_spec, set_vm_power_state, PyVmomi)
 
+
+# Maps id(content) -> content so the lookup cache below can be keyed on hashable values
+_CONTENT_REGISTRY = weakref.WeakValueDictionary()
+
+# Resolved objects shared by every PyVmomiCache instance, keyed on (id(content), dc_name, vim type, name)
+_FIND_OBJ_CACHE = {}
+
+
+def _register_content(content):
+    content_id = id(content)
+    if _CONTENT_REGISTRY.get(content_id) is not content:
+        # New connection (or a recycled id), previous lookups are not valid anymore
+        _FIND_OBJ_CACHE.clear()
+        _CONTENT_REGISTRY[content_id] = content
+    return content_id
+
+
+def _apply_connectable(dev, *, start_connected, connected=None):
+    """ Set the connectable fields of dev, reusing its ConnectInfo when it has one """
+    if dev.connectable is None:
+        dev.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+    dev.connectable.allowGuestControl = True
+    dev.connectable.startConnected = bool(start_connected)
+    if connected is not None:
+        dev.connectable.connected = bool(connected)
+
+
 class PyVmomiDeviceHelper(object):
     """ This class is a helper to create easily VMWare Objects for PyVmomiHelper """
 
@@ -148,13 +183,12 @@ class PyVmomiDeviceHelper(object):
         sio_ctl = vim.vm.device.VirtualDeviceSpec()
         sio_ctl.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
         sio_ctl.device = vim.vm.device.VirtualSIOController()
-        sio_ctl.device.deviceInfo = vim.Description()
         sio_ctl.device.busNumber = 0
 
         return sio_ctl
 
     @staticmethod
-    def create_floppy(sio_ctl, floppy_type, flp_path=None):
+    def create_floppy(sio_ctl, floppy_type, flp_path=None, start_connected=None, connected=None):
         if isinstance(sio_ctl, vim.vm.device.VirtualDeviceSpec):
             sio_ctl = sio_ctl.device
 
@@ -163,9 +197,9 @@ class PyVmomiDeviceHelper(object):
         floppy_spec.device = vim.vm.device.VirtualFloppy()
         floppy_spec.device.controllerKey = sio_ctl.key
         floppy_spec.device.key = -1
-        floppy_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-        floppy_spec.device.connectable.allowGuestControl = True
-        floppy_spec.device.connectable.startConnected = (floppy_type != "none")
+        if start_connected is None:
+            start_connected = (floppy_type != "none")
+        _apply_connectable(floppy_spec.device, start_connected=start_connected, connected=connected)
         if floppy_type in ["none", "client"]:
             floppy_spec.device.backing = vim.vm.device.VirtualFloppy.RemoteDeviceBackingInfo()
         elif floppy_type == "flp":
@@ -174,24 +208,26 @@ class PyVmomiDeviceHelper(object):
         return floppy_spec
 
     @staticmethod
-    def is_equal_floppy(vm_obj, floppy_device, floppy_type, flp_path):
-        if floppy_type == "none":
-            return (isinstance(floppy_device.backing, vim.vm.device.VirtualFloppy.RemoteDeviceBackingInfo) and
-                    floppy_device.connectable.allowGuestControl and
-                    not floppy_device.connectable.startConnected and
-                    (vm_obj.runtime.powerState != vim.VirtualMachinePowerState.poweredOn or not floppy_device.connectable.connected))
-        elif floppy_type == "client":
-            return (isinstance(floppy_device.backing, vim.vm.device.VirtualFloppy.RemoteDeviceBackingInfo) and
-                    floppy_device.connectable.allowGuestControl and
-                    floppy_device.connectable.startConnected and
-                    (vm_obj.runtime.powerState != vim.VirtualMachinePowerState.poweredOn or floppy_device.connectable.connected))
+    def is_equal_floppy(power_state, floppy_device, floppy_type, flp_path):
+        # Cheap discriminators first, the power state is only looked at when everything else matches
+        if floppy_type in ["none", "client"]:
+            if not isinstance(floppy_device.backing, _REMOTE_BACKING):
+                return False
         elif floppy_type == "flp":
-            return (isinstance(floppy_device.backing, vim.vm.device.VirtualFloppy.ImageBackingInfo) and
-                    floppy_device.backing.fileName == flp_path and
-                    floppy_device.connectable.allowGuestControl and
-                    floppy_device.connectable.startConnected and
-                    (vm_obj.runtime.powerState != vim.VirtualMachinePowerState.poweredOn or floppy_device.connectable.connected))
+            if not isinstance(floppy_device.backing, _IMAGE_BACKING):
+                return False
+            if floppy_device.backing.fileName != flp_path:
+                return False
+
+        if not floppy_device.connectable.allowGuestControl:
+            return False
+
+        connected = (floppy_type != "none")
+        if bool(floppy_device.connectable.startConnected) != connected:
+            return False
 
+        return (power_state != _POWER_ON or
+                bool(floppy_device.connectable.connected) == connected)
 
 
 class PyVmomiCache(object):
@@ -200,9 +236,6 @@ class PyVmomiCache(object):
     def __init__(self, content, dc_name=None):
         self.content = content
         self.dc_name = dc_name
-        self.networks = {}
-        self.clusters = {}
-        self.esx_hosts = {}
         self.parent_datacenters = {}
 
     def find_obj(self, content, types, name, confine_to_datacenter=True):
@@ -210,13 +243,48 @@ class PyVmomiCache(object):
         result = find_obj(content, types, name)
         if result and confine_to_datacenter:
             if self.get_parent_datacenter(result).name != self.dc_name:
-                result = None
-                objects = self.get_all_objs(content, types, confine_to_datacenter=True)
-                for obj in objects:
-                    if name is None or obj.name == name:
-                        return obj
+                result = self.find_in_datacenter(content, types, name)
+                if result is None:
+                    # Not a direct child of the datacenter folders, scan the datacenter as a last resort
+                    for obj in self.get_all_objs(content, types, confine_to_datacenter=True):
+                        if name is None or obj.name == name:
+                            return obj
         return result
 
+    def find_in_datacenter(self, content, types, name):
+        """ Ask the server SearchIndex for the object inside our datacenter instead of walking the inventory """
+        # Resolved by name so datacenters nested in folders are found too
+        datacenter = find_datacenter_by_name(content, self.dc_name)
+        if datacenter is None or name is None:
+            return None
+
+        si = content.searchIndex
+        if vim.HostSystem in types:
+            result = si.FindChild(entity=datacenter.hostFolder, name=name)
+            if (isinstance(result, vim.ComputeResource) and
+                    not isinstance(result, vim.ClusterComputeResource) and result.host):
+                # Standalone hosts live inside their own ComputeResource
+                result = result.host[0]
+            if not isinstance(result, vim.HostSystem):
+                result = si.FindByDnsName(datacenter=datacenter, dnsName=name, vmSearch=False)
+        else:
+            result = si.FindChild(entity=self.get_datacenter_folder(datacenter, types), name=name)
+
+        if result is not None and not isinstance(result, tuple(types)):
+            return None
+        return result
+
+    @staticmethod
+    def get_datacenter_folder(datacenter, types):
+        """ Return the datacenter root folder holding objects of the given types """
+        if vim.Network in types:
+            return datacenter.networkFolder
+        if vim.Datastore in types:
+            return datacenter.datastoreFolder
+        if vim.VirtualMachine in types:
+            return datacenter.vmFolder
+        return datacenter.hostFolder
+
     def get_all_objs(self, content, types, confine_to_datacenter=True):
         """ Wrapper around get_all_objs to set datacenter context """
         objects = get_all_objs(content, types)
@@ -236,31 +304,32 @@ class PyVmomiCache(object):
 
         return objects
 
-    def get_network(self, network):
-        if network not in self.networks:
-            self.networks[network] = self.find_obj(self.content, [vim.Network], network)
+    def get_cached_obj(self, obj_type, name):
+        """ Datacenter confined find_obj, remembered across PyVmomiCache instances """
+        key = (_register_content(self.content), self.dc_name, obj_type, name)
+        if key not in _FIND_OBJ_CACHE:
+            _FIND_OBJ_CACHE[key] = self.find_obj(self.content, [obj_type], name)
 
-        return self.networks[network]
+        return _FIND_OBJ_CACHE[key]
 
-    def get_cluster(self, cluster):
-        if cluster not in self.clusters:
-            self.clusters[cluster] = self.find_obj(self.content, [vim.ClusterComputeResource], cluster)
+    def get_network(self, network):
+        return self.get_cached_obj(vim.Network, network)
 
-        return self.clusters[cluster]
+    def get_cluster(self, cluster):
+        return self.get_cached_obj(vim.ClusterComputeResource, cluster)
 
     def get_esx_host(self, host):
-        if host not in self.esx_hosts:
-            self.esx_hosts[host] = self.find_obj(self.content, [vim.HostSystem], host)
-
-        return self.esx_hosts[host]
+        return self.get_cached_obj(vim.HostSystem, host)
 
-    def get_parent_datacenter(self, obj):
+    def get_parent_datacenter(self, orig):
         """ Walk the parent tree to find the objects datacenter """
-        if isinstance(obj, vim.Datacenter):
-            return obj
-        if obj in self.parent_datacenters:
-            return self.parent_datacenters[obj]
+        if isinstance(orig, vim.Datacenter):
+            return orig
+        if orig in self.parent_datacenters:
+            return self.parent_datacenters[orig]
         datacenter = None
+        obj = orig
+        chain = [orig]
         while True:
             if not hasattr(obj, 'parent'):
                 break
@@ -268,7 +337,14 @@ class PyVmomiCache(object):
             if isinstance(obj, vim.Datacenter):
                 datacenter = obj
                 break
-        self.parent_datacenters[obj] = datacenter
+            if obj in self.parent_datacenters:
+                # An ancestor was already resolved, reuse it
+                datacenter = self.parent_datacenters[obj]
+                break
+            chain.append(obj)
+        # Remember the answer for every node we walked through, not only the last one
+        for node in chain:
+            self.parent_datacenters[node] = datacenter
         return datacenter
 
 
@@ -279,18 +355,60 @@ class PyVmomiHelper(PyVmomi):
         self.configspec = None
         self.change_detected = False
         self.customspec = None
+        self.vm_props = {}
         self.cache = PyVmomiCache(self.content, dc_name=self.params['datacenter'])
 
     def gather_facts(self, vm):
         return gather_vm_facts(self.content, vm)
 
-    def remove_floppy(self, vm_obj):
+    def get_vm(self):
+        """ Look a VM given by name up through its inventory path, falling back to PyVmomi.get_vm """
+        vm = None
+        # uuid lookups already go through SearchIndex.FindByUuid in PyVmomi.get_vm
+        if (not self.params.get('uuid') and self.params.get('name') and self.params.get('datacenter') and
+                self.params.get('name_match') == 'first'):
+            vm = self.content.searchIndex.FindByInventoryPath(
+                inventoryPath="%s/vm/%s" % (self.params['datacenter'], self.params['name']))
+            if not isinstance(vm, vim.VirtualMachine):
+                vm = None
+
+        if vm is None:
+            return super(PyVmomiHelper, self).get_vm()
+
+        self.current_vm_obj = vm
+        return vm
+
+    def _fetch_vm_props(self, vm, paths=None):
+        """ Retrieve the VM properties used by the floppy operations in a single round-trip """
+        if paths is None:
+            paths = ['config.template', 'config.hardware.device', 'runtime.powerState']
+
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=vm, skip=False)
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=paths, all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+        self.vm_props = dict((path, None) for path in paths)
+        result = self.content.propertyCollector.RetrievePropertiesEx(
+            specSet=[filter_spec], options=vmodl.query.PropertyCollector.RetrieveOptions())
+        if result is not None:
+            for obj_content in result.objects:
+                for prop in obj_content.propSet:
+                    self.vm_props[prop.name] = prop.val
 
-        if vm_obj and vm_obj.config.template:
+        return self.vm_props
+
+    def _ensure_configspec(self):
+        if self.configspec is None:
+            self.configspec = vim.vm.ConfigSpec()
+            self.configspec.deviceChange = []
+        return self.configspec
+
+    def remove_floppy(self, vm_obj, floppy_device=None):
+
+        if vm_obj and self.vm_props.get('config.template'):
             # Changing floppy settings on a template is not supported
             return
 
-        floppy_device = self.get_vm_floppy_device(vm=vm_obj)
         if floppy_device is None:
             return
 
@@ -299,45 +417,42 @@ class PyVmomiHelper(PyVmomi):
         floppy_spec.device = floppy_device
 
         self.change_detected = True
-        self.configspec.deviceChange.append(floppy_spec)
+        self._ensure_configspec().deviceChange.append(floppy_spec)
 
-    def configure_floppy(self, vm_obj):
+    def configure_floppy(self, vm_obj, floppy_device=None, sio_device=None):
 
-        if vm_obj and vm_obj.config.template:
+        if vm_obj and self.vm_props.get('config.template'):
             # Changing floppy settings on a template is not supported
             return
 
         floppy_spec = None
-        floppy_device = self.get_vm_floppy_device(vm=vm_obj)
-        floppy_type = self.module.params["type"]
-        flp_path = self.module.params.get("image_file", None)
+        params = self.module.params
+        floppy_type = params["type"]
+        flp_path = params.get("image_file")
+        start_connected = params.get("start_connected", False)
+        powered_on = vm_obj and self.vm_props.get('runtime.powerState') == _POWER_ON
         if floppy_device is None:
             # Creating new floppy
-            sio_device = self.get_vm_sio_device(vm=vm_obj)
             if sio_device is None:
                 # Creating new SIO device
+                # A new floppy always follows, so change_detected is set below
                 sio_device = self.device_helper.create_sio_controller()
-                self.change_detected = True
-                self.configspec.deviceChange.append(sio_device)
+                self._ensure_configspec().deviceChange.append(sio_device)
 
-            floppy_spec = self.device_helper.create_floppy(sio_ctl=sio_device, floppy_type=floppy_type, flp_path=flp_path)
-            if vm_obj and vm_obj.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
-                floppy_spec.device.connectable.connected = (floppy_type != "none")
-                floppy_spec.device.connectable.startConnected = (
-                            floppy_type != "none" and self.module.params['start_connected'])
+            floppy_spec = self.device_helper.create_floppy(
+                sio_ctl=sio_device, floppy_type=floppy_type, flp_path=flp_path,
+                start_connected=(floppy_type != "none" and start_connected) if powered_on else None,
+                connected=(floppy_type != "none") if powered_on else None)
 
-        elif not self.device_helper.is_equal_floppy(vm_obj=vm_obj, floppy_device=floppy_device, floppy_type=floppy_type, flp_path=flp_path):
+        elif not self.device_helper.is_equal_floppy(power_state=self.vm_props.get('runtime.powerState'),
+                                                    floppy_device=floppy_device, floppy_type=floppy_type, flp_path=flp_path):
             # Updating an existing floppy
             if floppy_type in ["client", "none"]:
                 floppy_device.backing = vim.vm.device.VirtualFloppy.RemoteDeviceBackingInfo()
             elif floppy_type == "flp":
                 floppy_device.backing = vim.vm.device.VirtualFloppy.ImageBackingInfo(fileName=flp_path)
-            floppy_device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-            floppy_device.connectable.allowGuestControl = True
-            floppy_device.connectable.startConnected = (
-                    floppy_type != "none" and self.module.params['start_connected'])
-            if vm_obj and vm_obj.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
-                floppy_device.connectable.connected = (floppy_type != "none")
+            _apply_connectable(floppy_device, start_connected=(floppy_type != "none" and start_connected),
+                               connected=(floppy_type != "none") if powered_on else False)
 
             floppy_spec = vim.vm.device.VirtualDeviceSpec()
             floppy_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
@@ -345,99 +460,217 @@ class PyVmomiHelper(PyVmomi):
 
         if floppy_spec:
             self.change_detected = True
-            self.configspec.deviceChange.append(floppy_spec)
+            self._ensure_configspec().deviceChange.append(floppy_spec)
 
-    def get_vm_sio_device(self, vm=None):
+    def _scan_devices(self, vm=None):
+        """ Walk the VM device list once and return its (floppy, sio controller) devices """
+        floppy = None
+        sio = None
         if vm is None:
-            return None
-
-        for device in vm.config.hardware.device:
-            if isinstance(device, vim.vm.device.VirtualSIOController):
-                return device
+            return floppy, sio
+
+        devices = self.vm_props.get('config.hardware.device') or []
+        wanted = (_FLOPPY, _SIO_CTRL)
+        # Disks, NICs and friends are discarded with a single isinstance check
+        for device in (d for d in devices if isinstance(d, wanted)):
+            if isinstance(device, _FLOPPY):
+                if floppy is None:
+                    floppy = device
+            elif sio is None:
+                sio = device
+            if floppy is not None and sio is not None:
+                break
 
-        return None
+        return floppy, sio
 
-    def get_vm_floppy_device(self, vm=None):
-        if vm is None:
-            return None
+    def prepare_floppy_op(self, vm=None):
+        """ Compute the floppy changes for vm, returns the ConfigSpec to apply or None """
+        self.change_detected = False
 
-        for device in vm.config.hardware.device:
-            if isinstance(device, vim.vm.device.VirtualFloppy):
-                return device
+        # Fetch everything we need from the VM in one round-trip
+        self._fetch_vm_props(vm)
+        floppy_device, sio_device = self._scan_devices(vm=vm)
 
-        return None
+        # Configure the VM floppy, the ConfigSpec is only built once a device change shows up
+        self.configspec = None
 
-    def apply_floppy_op(self, vm=None):
-        # Configure the VM floppy
-        self.configspec = vim.vm.ConfigSpec()
-        self.configspec.deviceChange = []
+        state = self.module.params['state']
 
         # VM already exists
-        if self.module.params['state'] == 'absent':
+        if state == 'absent':
             # destroy it
-            self.remove_floppy(vm_obj=vm)
-        elif self.module.params['state'] == 'present':
-            if not self.module.params.get("type", None):
-                self.module.fail_json(msg="type is mandatory")
-
-            if self.module.params.get("type", None) not in ["none", "client", "flp"]:
-                self.module.fail_json(msg="type is not valid. Permitted values: none, client, image_file")
-
-            if self.module.params["type"] == "image_file" and not self.module.params.get("image_file", None):
-                self.module.fail_json(msg="image_file is mandatory in case type is flp")
-
-            self.configure_floppy(vm_obj=vm)
+            self.remove_floppy(vm_obj=vm, floppy_device=floppy_device)
+        elif state == 'present':
+            self.configure_floppy(vm_obj=vm, floppy_device=floppy_device, sio_device=sio_device)
         else:
             # This should not happen
             raise AssertionError()
 
-        change_applied = False
-
         # Only send VMWare task if we see a modification
-        if self.change_detected:
-            task = None
-            try:
-                task = vm.ReconfigVM_Task(spec=self.configspec)
-            except vim.fault.RestrictedVersion as e:
-                self.module.fail_json(msg="Failed to reconfigure virtual machine due to"
-                                          " product versioning restrictions: %s" % to_native(e.msg))
-            self.wait_for_task(task)
-            change_applied = True
-
-            if task.info.state == 'error':
-                # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=2021361
-                # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=2173
-                return {'changed': change_applied, 'failed': True, 'msg': task.info.error.msg}
+        if not self.change_detected:
+            return None
+        return self.configspec
+
+    @staticmethod
+    def reconfigure_vm(vm, spec):
+        """ Submit the reconfigure task, without waiting for it """
+        return vm.ReconfigVM_Task(spec=spec)
+
+    def start_floppy_op(self, vm=None):
+        """ Compute the floppy changes for vm and submit them, returns the Task or None if nothing changed """
+        spec = self.prepare_floppy_op(vm)
+        if spec is None:
+            return None
+
+        try:
+            return self.reconfigure_vm(vm, spec)
+        except vim.fault.RestrictedVersion as e:
+            self.module.fail_json(msg="Failed to reconfigure virtual machine due to"
+                                      " product versioning restrictions: %s" % to_native(e.msg))
+
+    def floppy_op_result(self, vm, task, state=None, error=None):
+        """ Build the module result for vm from the final state/error reported by wait_for_tasks """
+        change_applied = task is not None
+        if change_applied and state == 'error':
+            # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=2021361
+            # https://kb.vmware.com/selfservice/microsites/search.do?language=en_US&cmd=displayKC&externalId=2173
+            return {'changed': change_applied, 'failed': True,
+                    'msg': to_native(error.msg) if error is not None else "Reconfigure task failed"}
 
         vm_facts = self.gather_facts(vm)
         return {'changed': change_applied, 'failed': False, 'instance': vm_facts}
 
-    @staticmethod
-    def wait_for_task(task):
+    def apply_floppy_op(self, vm=None):
+        if self.module.check_mode:
+            # Report what would change without sending the reconfigure task
+            self.prepare_floppy_op(vm)
+            return {'changed': self.change_detected, 'failed': False, 'instance': self.gather_facts(vm)}
+
+        task = self.start_floppy_op(vm)
+        state = error = None
+        if task is not None:
+            state, error = self.wait_for_task(task)
+
+        return self.floppy_op_result(vm, task, state, error)
+
+    def apply_floppy_ops(self, vms, max_workers=16):
+        """ Apply the floppy configuration to several VMs, reconfiguring them concurrently
+
+        Meant for callers driving several VMs through one connection, e.g.
+            pyv = PyVmomiHelper(module)
+            results = pyv.apply_floppy_ops([vm1, vm2])
+        Every VM gets the configuration described by module.params. One result dict is
+        returned per VM, in the same order and with the same keys as apply_floppy_op.
+        A VM whose reconfigure fails is reported as failed in its own result. The other
+        VMs are still reconfigured and waited on.
+        """
+        specs = [(vm, self.prepare_floppy_op(vm)) for vm in vms]
+        if self.module.check_mode:
+            return [{'changed': spec is not None, 'failed': False, 'instance': self.gather_facts(vm)}
+                    for vm, spec in specs]
+
+        pending = [(vm, spec) for vm, spec in specs if spec is not None]
+
+        tasks = {}
+        failures = {}
+        if pending:
+            # The reconfigure calls are network bound, pyVmomi releases the GIL while waiting
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+                futures = [(vm, executor.submit(self.reconfigure_vm, vm, spec)) for vm, spec in pending]
+                for vm, future in futures:
+                    try:
+                        tasks[vm] = future.result()
+                    except vim.fault.RestrictedVersion as e:
+                        failures[vm] = ("Failed to reconfigure virtual machine due to"
+                                        " product versioning restrictions: %s" % to_native(e.msg))
+                    except vmodl.MethodFault as e:
+                        failures[vm] = "Failed to reconfigure virtual machine: %s" % to_native(e.msg)
+                    except Exception as e:
+                        failures[vm] = "Failed to reconfigure virtual machine: %s" % to_native(e)
+
+        outcomes = self.wait_for_tasks(list(tasks.values()))
+
+        results = []
+        for vm in vms:
+            if vm in failures:
+                results.append({'changed': False, 'failed': True, 'msg': failures[vm]})
+                continue
+            task = tasks.get(vm)
+            state, error = outcomes.get(task, (None, None)) if task is not None else (None, None)
+            results.append(self.floppy_op_result(vm, task, state, error))
+        return results
+
+    def wait_for_task(self, task):
+        """ Wait for task and return its final (state, error) """
+        return self.wait_for_tasks([task])[task]
+
+    def wait_for_tasks(self, tasks):
+        """ Wait for all tasks, returns a dict mapping each task to its final (state, error) """
         # https://www.vmware.com/support/developer/vc-sdk/visdk25pubs/ReferenceGuide/vim.Task.html
         # https://www.vmware.com/support/developer/vc-sdk/visdk25pubs/ReferenceGuide/vim.TaskInfo.html
         # https://github.com/virtdevninja/pyvmomi-community-samples/blob/master/samples/tools/tasks.py
-        while task.info.state not in ['error', 'success']:
-            time.sleep(1)
+        # Let the server push state changes through a single property collector filter
+        # instead of polling task.info every second
+        outcomes = dict((task, [None, None]) for task in tasks)
+        if not tasks:
+            return {}
+
+        pc = self.content.propertyCollector
+        obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks]
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task,
+                                                               pathSet=['info.state', 'info.error'],
+                                                               all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[prop_spec])
+        wait_options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=10)
+
+        pc_filter = pc.CreateFilter(filter_spec, True)
+        try:
+            version = None
+            pending = set(tasks)
+            while pending:
+                update = pc.WaitForUpdatesEx(version, wait_options)
+                if update is None:
+                    # maxWaitSeconds elapsed without any change
+                    continue
+                version = update.version
+                for filter_set in update.filterSet:
+                    for obj_set in filter_set.objectSet:
+                        outcome = outcomes.get(obj_set.obj)
+                        if outcome is None:
+                            continue
+                        for change in obj_set.changeSet:
+                            if change.name == 'info.state':
+                                outcome[0] = change.val
+                            elif change.name == 'info.error':
+                                outcome[1] = change.val
+                        if outcome[0] in ['error', 'success']:
+                            pending.discard(obj_set.obj)
+        finally:
+            pc_filter.Destroy()
+
+        return dict((task, tuple(outcome)) for task, outcome in outcomes.items())
+
+
+# Built once per process instead of on every main() call
+_ARG_SPEC = vmware_argument_spec()
+_ARG_SPEC.update(
+    state=dict(type='str', default='present',
+               choices=['present', 'absent']),
+
+    name=dict(type='str'),
+    guest_id=dict(type='str'),
+    image_file=dict(type='str'),
+    type=dict(type='str', default='none', choices=['none', 'client', 'flp']),
+    start_connected=dict(type='bool', default=False),
+    name_match=dict(type='str', choices=['first', 'last'], default='first'),
+
+    datacenter=dict(type='str', default='ha-datacenter'),
+    esxi_hostname=dict(type='str'),
+)
+
 
 def main():
-    argument_spec = vmware_argument_spec()
-    argument_spec.update(
-        state=dict(type='str', default='present',
-                   choices=['present', 'absent']),
-
-        name=dict(type='str'),
-        guest_id=dict(type='str'),
-        image_file=dict(type='str'),
-        type=dict(type='str', default=None),
-        start_connected=dict(type='bool', default=False),
-        name_match=dict(type='str', choices=['first', 'last'], default='first'),
-
-        datacenter=dict(type='str', default='ha-datacenter'),
-        esxi_hostname=dict(type='str'),
-    )
-
-    module = AnsibleModule(argument_spec=argument_spec,
+    module = AnsibleModule(argument_spec=_ARG_SPEC,
                            supports_check_mode=True,
                            mutually_exclusive=[
                                ['cluster', 'esxi_hostname'],
@@ -445,10 +678,16 @@ def main():
                            required_one_of=[
                                ['name', 'uuid'],
                            ],
+                           required_if=[
+                               ['type', 'flp', ['image_file']],
+                           ],
                            )
 
     result = {'failed': False, 'changed': False}
 
+    if not HAS_PYVMOMI:
+        module.fail_json(msg=missing_required_lib('PyVmomi'))
+
     pyv = PyVmomiHelper(module)
 
     # Check if the VM exists before continuing